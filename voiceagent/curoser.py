@@ -1,35 +1,86 @@
 import asyncio
+import atexit
+import logging
 import os
-import json
-import subprocess
+import orjson
+import re
+import shlex
+import time
 import requests
-import speech_recognition as sr
+from requests.adapters import HTTPAdapter
 import pyaudio
 from dotenv import load_dotenv
-from openai import OpenAI
-from groq import AsyncGroq
-from pydantic import BaseModel, Field
-from typing import Optional
+from groq import BadRequestError
+import msgspec
+
+from groq_clients import async_client
+from llm_cache import SqliteCache, make_cache_key
+from streaming_asr import StreamingTranscriber
 
 # Load environment variables
 load_dotenv()
 
+LLM_MODEL = "llama-3.3-70b-versatile"
+FAST_MODEL = "llama-3.1-8b-instant"
+
+# Utterances mentioning these likely need a tool (and the big model)
+TOOL_KEYWORDS = {
+    "weather", "temperature", "forecast",
+    "run", "execute", "command", "open", "launch", "kill",
+    "file", "folder", "create", "delete", "list"
+}
+
+def classify_task_complexity(user_query: str):
+    # Cheap heuristic: short utterances with no tool-ish words are chitchat
+    # and can be served by the small model with a stripped prompt
+    query = user_query.lower()
+    if len(user_query) < 40 and not any(word in query for word in TOOL_KEYWORDS):
+        return "simple"
+    return "complex"
+
+# Exact-replay cache: identical query + history skips the LLM entirely
+LLM_CACHE = SqliteCache(ttl_seconds=3600)
+
+# Action cache: repeat lookups for the same tool input within the TTL skip
+# execution. Only read-only tools belong here (run_command has side effects).
+TOOL_CACHE = SqliteCache(path="tool_cache.db", ttl_seconds=300, max_entries=128)
+CACHEABLE_TOOLS = {"get_weather"}
+
 # --- 1. SETUP CLIENTS ---
-client = OpenAI(
-    api_key=os.environ.get("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
-)
-async_client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"))
+# (shared HTTP/2 pool lives in groq_clients so connections stay warm)
+
+# --- 1b. LATENCY INSTRUMENTATION ---
+# One JSON line per turn so it's obvious whether ASR, LLM or TTS dominates
+# on this machine; tuning without these numbers is guesswork.
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+METRICS_LOG = logging.getLogger("voiceagent.latency")
+
+TURN_METRICS = {}
+
+def metric_set(name, value_ms):
+    # First observation wins (first token/byte is the one that matters)
+    TURN_METRICS.setdefault(name, round(value_ms))
+
+def metric_add(name, value_ms):
+    TURN_METRICS[name] = TURN_METRICS.get(name, 0) + round(value_ms)
+
+def emit_turn_metrics():
+    if TURN_METRICS:
+        METRICS_LOG.info(orjson.dumps(TURN_METRICS, option=orjson.OPT_SORT_KEYS).decode())
+        TURN_METRICS.clear()
 
 # --- 2. AUDIO PLAYER CLASS ---
 class LocalAudioPlayer:
-    def __init__(self, sample_rate=24000):
-        self.p = pyaudio.PyAudio()
+    def __init__(self, sample_rate=24000, pa=None):
+        self.owns_pa = pa is None
+        self.p = pa if pa is not None else pyaudio.PyAudio()
         self.stream = self.p.open(
             format=pyaudio.paInt16,
             channels=1,
             rate=sample_rate,
-            output=True
+            output=True,
+            frames_per_buffer=1024,
+            start=True  # stream is already running, first write is immediate
         )
 
     def write(self, chunk):
@@ -38,54 +89,348 @@ class LocalAudioPlayer:
     def close(self):
         self.stream.stop_stream()
         self.stream.close()
-        self.p.terminate()
+        if self.owns_pa:
+            self.p.terminate()
+
+# --- 3. STREAMING TTS PIPELINE ---
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+TTS_CONCURRENCY = 3
+
+# Raw s16le avoids the WAV header entirely; flips to "wav" (with exact
+# header stripping) the first time the API rejects "pcm"
+TTS_FORMAT = {"value": "pcm"}
 
-# --- 3. ASYNC TTS FUNCTION ---
-async def tts(speech: str):
+async def synthesize(speech: str):
     # Safety: Truncate to avoid model crash on long text
     safe_speech = speech[:200]
     try:
-        async with async_client.audio.speech.with_streaming_response.create(
-            model="canopylabs/orpheus-v1-english",
-            voice="troy",
-            input=safe_speech,
-            response_format="wav"
-        ) as response:
-            player = LocalAudioPlayer(sample_rate=24000)
-            # Skip WAV header (44 bytes) to prevent static "pop"
-            header_skipped = False
-            async for chunk in response.iter_bytes():
-                if not header_skipped and len(chunk) > 44:
-                    player.write(chunk[44:])
-                    header_skipped = True
-                else:
-                    player.write(chunk)
-            player.close()
+        return await _synthesize(safe_speech, TTS_FORMAT["value"])
+    except BadRequestError as e:
+        # Only a 400 means the format itself is unsupported; a transient
+        # timeout or 5xx must not downgrade the whole session to wav
+        if TTS_FORMAT["value"] == "pcm":
+            TTS_FORMAT["value"] = "wav"
+            try:
+                return await _synthesize(safe_speech, "wav")
+            except Exception as e:
+                print(f"Audio Error: {e}")
+        else:
+            print(f"Audio Error: {e}")
     except Exception as e:
         print(f"Audio Error: {e}")
+    return b""
+
+async def _synthesize(speech: str, response_format: str):
+    chunks = []
+    t_request_start = time.monotonic()
+    async with async_client.audio.speech.with_streaming_response.create(
+        model="canopylabs/orpheus-v1-english",
+        voice="troy",
+        input=speech,
+        response_format=response_format
+    ) as response:
+        iterator = response.iter_bytes()
+        if response_format == "wav":
+            # Consume exactly the 44 header bytes (which may span chunks)
+            # before the main loop, to prevent the static "pop"
+            header = b""
+            async for chunk in iterator:
+                if not chunks and not header:
+                    metric_set("tts_ttfb_ms",
+                               (time.monotonic() - t_request_start) * 1000)
+                header += chunk
+                if len(header) >= 44:
+                    chunks.append(header[44:])
+                    break
+        # Branchless hot loop: no per-chunk header check or slicing
+        async for chunk in iterator:
+            if not chunks:
+                metric_set("tts_ttfb_ms",
+                           (time.monotonic() - t_request_start) * 1000)
+            chunks.append(chunk)
+    metric_add("tts_total_ms", (time.monotonic() - t_request_start) * 1000)
+    return b"".join(chunks)
+
+# 1024 frames of s16le mono ≈ 43ms at 24kHz: one blocking write per slice
+# keeps the gap between cancellation points short
+PLAYBACK_SLICE_BYTES = 2048
+
+# Exactly one task may write to the output stream at a time; without this
+# a lingering sentence or filler write interleaves with the next turn's
+# audio into garbage
+PLAYBACK_LOCK = asyncio.Lock()
+
+async def play_pcm(player, pcm):
+    # Write in small slices, each in a thread, so cancelling the playing
+    # task (barge-in) takes effect within ~40ms instead of only after the
+    # whole sentence has left the speaker
+    loop = asyncio.get_running_loop()
+    async with PLAYBACK_LOCK:
+        for i in range(0, len(pcm), PLAYBACK_SLICE_BYTES):
+            await loop.run_in_executor(
+                None, player.write, pcm[i:i + PLAYBACK_SLICE_BYTES]
+            )
+
+async def tts_pipeline(player: LocalAudioPlayer, sentences: asyncio.Queue,
+                       gate: asyncio.Event = None):
+    # Synthesize up to TTS_CONCURRENCY sentences in parallel while keeping
+    # playback strictly in order: the producer enqueues synthesis tasks as
+    # sentences arrive, the consumer awaits them FIFO and writes the audio.
+    # The player is long-lived (opening a PortAudio stream costs hundreds
+    # of ms) and is only closed at process exit. A gate, when given, holds
+    # playback (synthesis still runs) until the caller confirms the turn.
+    semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+    ordered = asyncio.Queue()
+
+    async def synth(sentence):
+        async with semaphore:
+            return await synthesize(sentence)
+
+    async def producer():
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                await ordered.put(None)
+                return
+            await ordered.put(asyncio.create_task(synth(sentence)))
+
+    async def consumer():
+        if gate is not None:
+            await gate.wait()
+        while True:
+            task = await ordered.get()
+            if task is None:
+                return
+            pcm = await task
+            if pcm:
+                # The answer supersedes a still-playing filler rather
+                # than queueing behind (or overlapping) it
+                filler = CURRENT_FILLER["task"]
+                if filler is not None and not filler.done():
+                    filler.cancel()
+                # Sliced writes keep the event loop free and make the
+                # playing sentence itself cancellable mid-stream
+                await play_pcm(player, pcm)
+
+    try:
+        await asyncio.gather(producer(), consumer())
+    finally:
+        # Finished or cancelled mid-playback (barge-in): drop queued work
+        while not ordered.empty():
+            task = ordered.get_nowait()
+            if task is not None:
+                task.cancel()
+
+class OutputSentenceScanner:
+    # Incrementally pulls the "content" string value of an "output" step out
+    # of a streaming JSON response, so TTS can start on the first sentence
+    # long before the closing brace arrives.
+    STEP_OUTPUT = re.compile(r'"step"\s*:\s*"output"')
+    CONTENT_KEY = re.compile(r'"content"\s*:\s*"')
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "n": "\n", "t": "\t",
+               "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self):
+        self.raw = ""
+        self.pos = None     # index into raw, just past content's opening quote
+        self.text = ""      # decoded content not yet emitted as a sentence
+        self.done = False
+
+    def feed(self, delta: str):
+        # Returns the complete sentences newly available after this delta.
+        self.raw += delta
+        if self.done:
+            return []
+        if self.pos is None:
+            if not self.STEP_OUTPUT.search(self.raw):
+                return []
+            match = self.CONTENT_KEY.search(self.raw)
+            if not match:
+                return []
+            self.pos = match.end()
+        self._decode()
+        return self._split(final=self.done)
+
+    def flush(self):
+        # Stream ended: emit whatever content is left, sentence or not.
+        self.done = True
+        remaining, self.text = self.text.strip(), ""
+        return [remaining] if remaining else []
+
+    def _decode(self):
+        while self.pos < len(self.raw):
+            ch = self.raw[self.pos]
+            if ch == "\\":
+                if self.pos + 1 >= len(self.raw):
+                    return  # escape split across chunks, wait for more
+                esc = self.raw[self.pos + 1]
+                if esc == "u":
+                    if self.pos + 6 > len(self.raw):
+                        return
+                    self.text += chr(int(self.raw[self.pos + 2:self.pos + 6], 16))
+                    self.pos += 6
+                else:
+                    self.text += self.ESCAPES.get(esc, esc)
+                    self.pos += 2
+            elif ch == '"':
+                self.done = True
+                return
+            else:
+                self.text += ch
+                self.pos += 1
+
+    def _split(self, final):
+        parts = SENTENCE_END.split(self.text)
+        if final:
+            self.text = ""
+            return [p for p in parts if p.strip()]
+        self.text = parts[-1]
+        return [p for p in parts[:-1] if p.strip()]
+
+def discard_speculation(task):
+    # Drop a speculative stream_llm_step run. Cancelling a running task
+    # tears down its gated pipeline via the CancelledError handler, but a
+    # task that already finished has returned a pipeline parked on
+    # gate.wait() — cancel it here or it (and its synthesized audio)
+    # leaks for the life of the process.
+    # A discarded run's timings aren't part of any spoken turn
+    TURN_METRICS.clear()
+    if task is None or task.cancelled():
+        return
+    if not task.done():
+        task.cancel()
+    elif task.exception() is None:
+        _, pipeline = task.result()
+        pipeline.cancel()
+
+# "Thinking" fillers spoken while a tool runs, synthesized once at startup
+# so tool turns never sit in silence (and cost no extra TTS calls)
+FILLER_TEXT = {
+    "get_weather": "Let me check the weather.",
+    "run_command": "Okay, on it."
+}
+FILLERS = {}
+CURRENT_FILLER = {"task": None}  # so the answer path can stop it
+
+async def pregen_fillers():
+    for tool_name, text in FILLER_TEXT.items():
+        FILLERS[tool_name] = await synthesize(text)
+
+# --- 3b. WARM-UP ---
+async def _warm_llm():
+    # One tiny completion primes TLS + model routing on the chat path
+    try:
+        await async_client.chat.completions.create(
+            model=FAST_MODEL,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1
+        )
+    except Exception as e:
+        print(f"⚠️ LLM warm-up failed: {e}")
+
+async def _warm_tts():
+    # A one-word synthesis primes the TTS path; the bytes are discarded
+    await synthesize("Hi")
+
+async def stream_llm_step(player, message_history, model=LLM_MODEL, gate=None):
+    # Stream the LLM response, feeding output-step sentences into TTS as
+    # they arrive so the first audio byte is produced well before the model
+    # finishes. Returns the full raw JSON plus the playback task, which the
+    # caller keeps running in the background (and may cancel for barge-in).
+    # Speculative callers pass a gate that holds playback until confirmed.
+    sentences = asyncio.Queue()
+    pipeline = asyncio.create_task(tts_pipeline(player, sentences, gate))
+    scanner = OutputSentenceScanner()
+    raw_json = ""
+    cache_key = make_cache_key(model, message_history, available_tools)
+    try:
+        cached = LLM_CACHE.get(cache_key)
+        if cached is not None:
+            print("⚡ LLM cache hit")
+            raw_json = cached
+            for sentence in scanner.feed(cached):
+                await sentences.put(sentence)
+        else:
+            t_request_start = time.monotonic()
+            stream = await async_client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=message_history,
+                stream=True
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if not raw_json:
+                    metric_set("llm_ttft_ms",
+                               (time.monotonic() - t_request_start) * 1000)
+                raw_json += delta
+                for sentence in scanner.feed(delta):
+                    await sentences.put(sentence)
+            metric_add("llm_total_ms",
+                       (time.monotonic() - t_request_start) * 1000)
+            try:
+                orjson.loads(raw_json)  # never cache malformed responses
+                LLM_CACHE.put(cache_key, raw_json)
+            except orjson.JSONDecodeError:
+                pass
+        if scanner.pos is not None:
+            for sentence in scanner.flush():
+                await sentences.put(sentence)
+        else:
+            # Model emitted fields in an unexpected order; fall back to
+            # speaking the parsed content once the JSON is complete.
+            try:
+                parsed = orjson.loads(raw_json)
+                if parsed.get("step", "").lower() == "output" and parsed.get("content"):
+                    await sentences.put(parsed["content"])
+            except orjson.JSONDecodeError:
+                pass
+    except asyncio.CancelledError:
+        # Speculative run discarded: take the pipeline down with us
+        pipeline.cancel()
+        raise
+    finally:
+        await sentences.put(None)
+    return raw_json, pipeline
 
 # --- 4. DATA MODEL & TOOLS ---
-class StepModel(BaseModel):
-    step: str = Field(..., description="The step name: 'plan', 'tool', or 'output'")
-    content: Optional[str] = Field(None, description="The reasoning or final message")
-    tool: Optional[str] = Field(None, description="The name of the tool to call")
-    input: Optional[str] = Field(None, description="The input argument for the tool")
+class StepModel(msgspec.Struct):
+    step: str                  # "tool" or "output"
+    content: str | None = None  # the reasoning or final message
+    tool: str | None = None     # the name of the tool to call
+    input: str | None = None    # the input argument for the tool
 
-def run_command(cmd: str):
+# Precompiled decoder: parsing + validation in one pass, no per-call setup
+STEP_DECODER = msgspec.json.Decoder(StepModel)
+
+async def run_command(cmd: str):
+    # exec (no shell fork), async so TTS/ASR keep running while it works
     try:
         print(f"Executing system command: {cmd}")
-        # Run command and capture output
-        result = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-        return result.decode("utf-8").strip()
-    except subprocess.CalledProcessError as e:
-        return f"Error executing command: {e.output.decode('utf-8')}"
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(cmd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        out, _ = await proc.communicate()
+        if proc.returncode != 0:
+            return f"Error executing command: {out.decode('utf-8')}"
+        return out.decode("utf-8").strip()
     except Exception as e:
         return f"Error: {str(e)}"
 
+# One session for all weather lookups: keep-alive pooling means repeat
+# calls skip the TCP+TLS handshake to wttr.in (~100-300ms each)
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "curl/7.68.0"
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
 def get_weather(city: str):
     url = f"https://wttr.in/{city.lower()}?format=%C+%t"
     try:
-        response = requests.get(url, headers={"User-Agent": "curl/7.68.0"}, timeout=10)
+        response = SESSION.get(url, timeout=10)
         if response.status_code == 200:
             return f"The weather in {city} is {response.text.strip()}"
         return "Error: Could not get weather."
@@ -97,15 +442,49 @@ available_tools = {
     "run_command": run_command
 }
 
+# --- 4b. HISTORY COMPACTION ---
+HISTORY_LIMIT = 9   # compact once history outgrows this many messages
+KEEP_RECENT = 6     # most recent messages kept verbatim
+
+async def compact_history(message_history):
+    # Groq latency scales with input tokens, so an unbounded history makes
+    # every call slower as the session ages. Collapse everything between
+    # the system prompt and the last few messages into one short summary.
+    if len(message_history) <= HISTORY_LIMIT:
+        return message_history
+
+    old = message_history[1:-KEEP_RECENT]
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old)
+    try:
+        response = await async_client.chat.completions.create(
+            model=FAST_MODEL,
+            messages=[{
+                "role": "user",
+                "content": "Summarize this conversation in at most"
+                           " 100 tokens:\n" + transcript
+            }],
+            max_tokens=120
+        )
+        summary = response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"⚠️ Summary Error: {e}")
+        return message_history  # better a slow call than lost context
+
+    return (
+        [message_history[0],
+         {"role": "system", "content": f"Context summary: {summary}"}]
+        + message_history[-KEEP_RECENT:]
+    )
+
 # --- 5. MAIN LOGIC ---
-def main():
+async def main_async():
     SYSTEM_PROMPT = """
     You are a Voice AI Agent capable of executing tools.
     You MUST respond with valid JSON that matches this structure:
     {
-      "step": "plan" | "tool" | "output",
+      "step": "tool" | "output",
       "content": "string",
-      "tool": "tool_name", 
+      "tool": "tool_name",
       "input": "tool_input"
     }
 
@@ -114,106 +493,218 @@ def main():
     - run_command(cmd) : Execute a shell command on the user's computer.
 
     Rules:
-    1. First, PLAN what to do.
-    2. If needed, use a TOOL.
-    3. Finally, provide an OUTPUT to speak to the user.
+    1. If no tool is needed, emit an "output" step directly.
+    2. If a tool is needed, emit a single "tool" step, then an "output"
+       step once you see the observation.
+    3. Do NOT emit a "plan" step.
+    """
+
+    # Stripped prompt for chitchat turns: no tool schema (~3KB fewer tokens)
+    SIMPLE_SYSTEM_PROMPT = """
+    You are a Voice AI Agent. You MUST respond with valid JSON:
+    {"step": "output", "content": "string"}
+    Keep "content" short and conversational (it is spoken aloud).
     """
 
     print("--- 🎙️ Voice Agent Started ---")
-    
+
     # Initialize History
     message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
-    
-    # Initialize Speech Recognizer
-    r = sr.Recognizer()
-    
-    # Open Microphone ONCE and keep it open
-    with sr.Microphone() as source:
-        r.adjust_for_ambient_noise(source)
-        r.pause_threshold = 1.5
-        print("🟢 Ready! Speak now...")
 
-        while True:
-            try:
-                print("\n👂 Listening...")
-                audio = r.listen(source)
-                print("🧠 Processing Audio...")
-                
-                # 1. Speech to Text
-                user_query = r.recognize_google(audio)
-                print(f"🗣️ You said: {user_query}")
-                
-                # Add User Query to History
-                message_history.append({"role": "user", "content": user_query})
-
-                # 2. Agent Reasoning Loop (Repeat until 'output' step)
-                while True:
-                    # Call LLM
-                    response = client.chat.completions.create(
-                        model="llama-3.3-70b-versatile",
-                        response_format={"type": "json_object"}, 
-                        messages=message_history
+    def build_turn_messages(history, model):
+        # Simple turns get the stripped prompt (no tool schema)
+        if model == FAST_MODEL:
+            return [{"role": "system", "content": SIMPLE_SYSTEM_PROMPT}] + history[1:]
+        return history
+
+    speaking_task = None  # TTS playback running in the background
+
+    # One PyAudio instance backs both the 16kHz mono mic stream and the
+    # 24kHz playback stream, so PortAudio is initialized exactly once
+    pa = pyaudio.PyAudio()
+    atexit.register(pa.terminate)
+
+    # One player (and PortAudio stream) for the whole session
+    player = LocalAudioPlayer(sample_rate=24000, pa=pa)
+    atexit.register(player.close)
+
+    # The expensive startup steps are independent, so run them all at
+    # once: loading the ASR models (streaming faster-whisper + Silero VAD)
+    # happens in a thread while the API warm-ups and filler synthesis run
+    # on the loop. Startup costs max-of-steps instead of sum-of-steps.
+    loop = asyncio.get_running_loop()
+    transcriber, *_ = await asyncio.gather(
+        loop.run_in_executor(None, lambda: StreamingTranscriber(pa=pa)),
+        _warm_llm(),
+        _warm_tts(),
+        pregen_fillers()
+    )
+    atexit.register(transcriber.close)
+
+    # Warm-ups and filler synthesis record TTS timings of their own;
+    # drop them so the first turn's metrics line only covers the turn
+    TURN_METRICS.clear()
+
+    print("🟢 Ready! Speak now...")
+
+    while True:
+        try:
+            print("\n👂 Listening...")
+
+            # Speculative prefill: launch the LLM on a stable partial and
+            # relaunch whenever the partial mutates; playback stays gated
+            # until the final transcript confirms the guess
+            pending = {"task": None, "partial": None, "gate": None}
+
+            def on_partial(text):
+                # First sign of speech doubles as barge-in
+                if speaking_task and not speaking_task.done():
+                    speaking_task.cancel()
+                if pending["partial"] == text:
+                    return
+                discard_speculation(pending["task"])
+                if classify_task_complexity(text) == "simple":
+                    spec_model = FAST_MODEL
+                else:
+                    spec_model = LLM_MODEL
+                spec_history = message_history + [{"role": "user", "content": text}]
+                pending["partial"] = text
+                pending["gate"] = asyncio.Event()
+                pending["task"] = asyncio.create_task(stream_llm_step(
+                    player, build_turn_messages(spec_history, spec_model),
+                    model=spec_model, gate=pending["gate"]
+                ))
+
+            # 1. Speech to Text (partials stream in while the user talks)
+            user_query = await transcriber.listen(on_partial=on_partial)
+            if not user_query:
+                discard_speculation(pending["task"])
+                print("... (Silence) ...")
+                continue
+
+            # Barge-in: new speech cancels whatever is still playing
+            if speaking_task and not speaking_task.done():
+                speaking_task.cancel()
+
+            print(f"🗣️ You said: {user_query}")
+
+            # Reuse the speculative run if the transcript didn't change
+            spec_task = None
+            if pending["task"] is not None and pending["partial"] == user_query:
+                spec_task = pending["task"]
+                pending["gate"].set()  # release the held audio
+            else:
+                discard_speculation(pending["task"])
+
+            # Add User Query to History
+            message_history.append({"role": "user", "content": user_query})
+
+            # Route trivial utterances to the small model
+            if classify_task_complexity(user_query) == "simple":
+                model = FAST_MODEL
+            else:
+                model = LLM_MODEL
+
+            # 2. Agent Reasoning Loop (Repeat until 'output' step)
+            while True:
+                if spec_task is not None:
+                    # Prefill already ran while the user finished talking
+                    raw_json_str, speaking_task = await spec_task
+                    spec_task = None
+                else:
+                    # Call LLM (streamed; output-step audio starts mid-stream)
+                    raw_json_str, speaking_task = await stream_llm_step(
+                        player, build_turn_messages(message_history, model),
+                        model=model
                     )
-                    
-                    raw_json_str = response.choices[0].message.content
-                    
-                    # Validate JSON
-                    try:
-                        parsed_result = StepModel.model_validate_json(raw_json_str)
-                    except Exception as e:
-                        print(f"⚠️ JSON Parse Error: {e}")
-                        break # Break inner loop to listen again
-
-                    # Add Assistant's thought to history
-                    message_history.append({"role": "assistant", "content": raw_json_str})
-                    
-                    step_type = parsed_result.step.lower()
-
-                    # --- PLAN ---
-                    if step_type == "plan":
-                        print(f"📝 PLAN: {parsed_result.content}")
-                        # Loop again to let AI execute the plan (it will output 'tool' next)
-                        continue
-
-                    # --- TOOL ---
-                    elif step_type == "tool":
-                        tool_name = parsed_result.tool
-                        tool_in = parsed_result.input
-                        
-                        print(f"🛠️ TOOL: {tool_name}('{tool_in}')")
-                        
-                        if tool_name in available_tools:
-                            tool_output = available_tools[tool_name](tool_in)
-                        else:
+
+                # Validate JSON
+                try:
+                    parsed_result = STEP_DECODER.decode(raw_json_str.encode())
+                except Exception as e:
+                    print(f"⚠️ JSON Parse Error: {e}")
+                    break # Break inner loop to listen again
+
+                # Add Assistant's thought to history
+                message_history.append({"role": "assistant", "content": raw_json_str})
+                
+                step_type = parsed_result.step.lower()
+
+                # --- TOOL ---
+                if step_type == "tool":
+                    tool_name = parsed_result.tool
+                    tool_in = parsed_result.input
+
+                    print(f"🛠️ TOOL: {tool_name}('{tool_in}')")
+
+                    action_key = f"{tool_name}:{tool_in}"
+                    tool_output = None
+                    if tool_name in CACHEABLE_TOOLS:
+                        tool_output = TOOL_CACHE.get(action_key)
+
+                    if tool_output is None:
+                        # Speak a canned filler while the tool does its work
+                        if FILLERS.get(tool_name):
+                            CURRENT_FILLER["task"] = asyncio.create_task(
+                                play_pcm(player, FILLERS[tool_name])
+                            )
+                        fn = available_tools.get(tool_name)
+                        if fn is None:
                             tool_output = "Error: Tool not found"
-                        
-                        print(f"👀 RESULT: {tool_output}")
-                        
-                        # Add Observation to history so AI knows the result
-                        obs_json = json.dumps({"step": "observe", "content": tool_output})
-                        message_history.append({"role": "user", "content": obs_json})
-                        # Loop again to let AI process the observation
-                        continue
-
-                    # --- OUTPUT (Final Answer) ---
-                    elif step_type == "output":
-                        final_response = parsed_result.content
-                        print(f"🤖 AI: {final_response}")
-                        
-                        # Speak Response
-                        asyncio.run(tts(speech=final_response))
-                        
-                        # Break inner loop to go back to listening for new user input
-                        break 
-
-            except sr.UnknownValueError:
-                print("... (Silence) ...")
-            except sr.RequestError:
-                print("❌ Connection error with Speech Service.")
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                # Reset history on critical error to avoid loop
-                message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
+                        elif asyncio.iscoroutinefunction(fn):
+                            tool_output = await fn(tool_in)
+                        else:
+                            # Sync tools (blocking requests calls) go to a
+                            # thread: awaiting here lets the filler task
+                            # start and keeps playback/ASR running
+                            tool_output = await loop.run_in_executor(
+                                None, fn, tool_in
+                            )
+                        if (tool_name in CACHEABLE_TOOLS
+                                and not tool_output.startswith("Error")):
+                            TOOL_CACHE.put(action_key, tool_output)
+
+                    print(f"👀 RESULT: {tool_output}")
+                    
+                    # Add Observation to history so AI knows the result
+                    obs_json = orjson.dumps(
+                        {"step": "observe", "content": tool_output}
+                    ).decode()
+                    message_history.append({"role": "user", "content": obs_json})
+                    # Loop again to let AI process the observation
+                    continue
+
+                # --- OUTPUT (Final Answer) ---
+                elif step_type == "output":
+                    final_response = parsed_result.content
+                    print(f"🤖 AI: {final_response}")
+
+                    # Playback keeps running as speaking_task while we
+                    # go straight back to listening (enables barge-in)
+                    break
+
+                # --- ANYTHING ELSE (e.g. a stray "plan") ---
+                else:
+                    print(f"📝 {step_type.upper()}: {parsed_result.content}")
+                    # Loop again so the model gets to the real step
+                    continue
+
+            # 3. Keep prefill cost bounded across the session
+            message_history = await compact_history(message_history)
+
+            # 4. One structured latency line per turn
+            if transcriber.last_eou_ms is not None:
+                metric_set("eou_ms", transcriber.last_eou_ms)
+            emit_turn_metrics()
+
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            # Reset history on critical error to avoid loop
+            message_history = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+def main():
+    # Single persistent event loop for the whole session
+    asyncio.run(main_async())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,26 @@
+import os
+
+import httpx
+from dotenv import load_dotenv
+from groq import AsyncGroq
+from openai import OpenAI
+
+load_dotenv()
+
+# One HTTP/2 keep-alive pool per process, shared by every chat and TTS call,
+# so only the first request pays the TLS handshake to Groq.
+TIMEOUT = httpx.Timeout(30.0)
+LIMITS = httpx.Limits(max_keepalive_connections=8, keepalive_expiry=60)
+
+shared_http = httpx.AsyncClient(http2=True, timeout=TIMEOUT, limits=LIMITS)
+shared_http_sync = httpx.Client(http2=True, timeout=TIMEOUT, limits=LIMITS)
+
+client = OpenAI(
+    api_key=os.environ.get("GROQ_API_KEY"),
+    base_url="https://api.groq.com/openai/v1",
+    http_client=shared_http_sync
+)
+async_client = AsyncGroq(
+    api_key=os.environ.get("GROQ_API_KEY"),
+    http_client=shared_http
+)
@@ -0,0 +1,75 @@
+import hashlib
+import sqlite3
+import time
+from typing import Optional, Protocol
+
+import orjson
+
+# Local response cache for the agent's LLM calls. Because the cache key
+# covers the full message history, a repeated query replays the whole
+# plan/tool/output sequence step by step without any LLM round trips
+# (tool calls themselves still run for real, since their data may be fresh).
+
+# --- 1. CACHE KEY ---
+def make_cache_key(model, messages, tool_names):
+    # Serialized once per LLM call over the full history, so use orjson
+    payload = orjson.dumps(
+        {"model": model, "messages": messages, "tools": sorted(tool_names)},
+        option=orjson.OPT_SORT_KEYS
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+# --- 2. BACKEND PROTOCOL ---
+class CacheBackend(Protocol):
+    def get(self, key: str) -> Optional[str]: ...
+    def put(self, key: str, value: str) -> None: ...
+
+# --- 3. SQLITE BACKEND ---
+class SqliteCache:
+    def __init__(self, path="llm_cache.db", ttl_seconds=3600, max_entries=256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value, created FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if now - created > self.ttl_seconds:
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self.conn.commit()
+            return None
+        # Touch for LRU eviction
+        self.conn.execute(
+            "UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key)
+        )
+        self.conn.commit()
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, created, last_used)"
+            " VALUES (?, ?, ?, ?)",
+            (key, value, now, now)
+        )
+        # Evict least-recently-used entries beyond max_entries
+        self.conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY last_used DESC"
+            " LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.commit()
@@ -1,11 +1,10 @@
 import asyncio
-import os
 from dotenv import load_dotenv
-import speech_recognition as sr
-from openai import OpenAI
-from groq import AsyncGroq
 import pyaudio
 
+from groq_clients import client, async_client
+from streaming_asr import StreamingTranscriber
+
 load_dotenv()
 
 # --- 1. AUDIO PLAYER SETTINGS ---
@@ -29,11 +28,7 @@ class LocalAudioPlayer:
 
 # ------------------------------------------------------------------------
 
-client = OpenAI(
-    api_key=os.environ.get("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
-)
-async_client = AsyncGroq()
+# Shared HTTP/2 keep-alive clients (see groq_clients.py)
 
 async def tts(speech: str):
     # SAFETY LOCK: The Orpheus model crashes if text is > 200 chars.
@@ -57,50 +52,47 @@ async def tts(speech: str):
     except Exception as e:
         print(f"Audio Error: {e}")
 
-def main():
-    r = sr.Recognizer()
-
+async def main_async():
     # FIX: Use a stable model system prompt
     SYSTEM_PROMPT = "You are a helpful voice assistant. You MUST keep your answers extremely short (under 2 sentences)."
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
 
-    with sr.Microphone() as source:
-        r.adjust_for_ambient_noise(source)
-        r.pause_threshold = 1.5
-        
-        print("Voice Agent Ready. Speak now!")
-
-        while True:
-            print("\nListening...")
-            try:
-                audio = r.listen(source)
-                print("Processing...")
-                
-                stt = r.recognize_google(audio)
-                print("You said:", stt)
-
-                messages.append({"role": "user", "content": stt})
-
-                # FIX: Changed model to a STABLE version
-                response = client.chat.completions.create(
-                    model="llama-3.3-70b-versatile", 
-                    messages=messages
-                )
-                
-                ai_text = response.choices[0].message.content
-                print("AI response:", ai_text)
-                
-                messages.append({"role": "assistant", "content": ai_text})
-                
-                # Speak Response
-                asyncio.run(tts(speech=ai_text))
-
-            except sr.UnknownValueError:
+    # Direct 16kHz mono PyAudio capture via the streaming transcriber;
+    # no speech_recognition wrapper, no resampling step
+    transcriber = StreamingTranscriber()
+
+    print("Voice Agent Ready. Speak now!")
+
+    while True:
+        print("\nListening...")
+        try:
+            stt = await transcriber.listen()
+            if not stt:
                 print("...")
-            except sr.RequestError:
-                print("Connection error.")
-            except Exception as e:
-                print(f"An error occurred: {e}")
+                continue
+            print("You said:", stt)
+
+            messages.append({"role": "user", "content": stt})
+
+            # FIX: Changed model to a STABLE version
+            response = client.chat.completions.create(
+                model="llama-3.3-70b-versatile",
+                messages=messages
+            )
+
+            ai_text = response.choices[0].message.content
+            print("AI response:", ai_text)
+
+            messages.append({"role": "assistant", "content": ai_text})
+
+            # Speak Response
+            await tts(speech=ai_text)
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+def main():
+    asyncio.run(main_async())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import numpy as np
+import pyaudio
+import torch
+from faster_whisper import WhisperModel
+
+# Streaming ASR: chunked mic reads feed a local faster-whisper model so a
+# transcript exists while the user is still talking, instead of uploading a
+# finished recording to Google after a fixed pause_threshold wait.
+
+SAMPLE_RATE = 16000
+FRAME_MS = 32
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000  # 512 samples, Silero's unit
+MAX_BUFFER_SECONDS = 30       # rolling window fed to the model
+DECODE_INTERVAL = 0.5         # seconds between incremental decodes
+ENDPOINT_SILENCE_MS = 200     # trailing silence that ends the utterance
+SPEECH_PROB_THRESHOLD = 0.3   # Silero probability below this is silence
+
+class StreamingTranscriber:
+    # Emits stable partial hypotheses while the user speaks and a final
+    # transcript once they stop. Partials are stabilized with
+    # LocalAgreement-2: only the prefix on which two consecutive decodes
+    # agree is reported, so downstream consumers can act on them early.
+    def __init__(self, model_size="small", pa=None):
+        self.model = WhisperModel(model_size, compute_type="int8")
+        # Neural VAD for endpointing: ~200ms of trailing silence closes the
+        # utterance, versus the old fixed 1.5s pause_threshold
+        self.vad_model, _ = torch.hub.load(
+            "snakers4/silero-vad", "silero_vad", trust_repo=True
+        )
+        self.last_eou_ms = None  # VAD endpoint -> final transcript, per turn
+        # A PyAudio instance can be shared with the playback side; only
+        # terminate it if we created it ourselves
+        self.owns_pa = pa is None
+        self.pa = pa if pa is not None else pyaudio.PyAudio()
+        self.stream = self.pa.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=SAMPLE_RATE,
+            input=True,
+            frames_per_buffer=FRAME_SAMPLES
+        )
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        if self.owns_pa:
+            self.pa.terminate()
+
+    async def listen(self, on_partial=None):
+        # Capture one utterance and return its final transcript ("" if the
+        # mic only heard silence). on_partial(text) is called from the event
+        # loop whenever the stable partial grows. A dedicated reader task
+        # keeps draining mic frames while a decode is in flight, so a slow
+        # CPU decode can't overflow PortAudio's input buffer and silently
+        # drop the audio it is transcribing.
+        loop = asyncio.get_running_loop()
+        self.vad_model.reset_states()
+        frames = asyncio.Queue()
+
+        async def reader():
+            while True:
+                frame = await loop.run_in_executor(None, self._read_frame)
+                await frames.put(frame)
+
+        reader_task = asyncio.create_task(reader())
+        buffer = b""
+        heard_speech = False
+        silent_ms = 0
+        stable = ""
+        prev_words = []
+        last_decode = 0.0
+
+        try:
+            while True:
+                frame = await frames.get()
+                if self._is_speech(frame):
+                    heard_speech = True
+                    silent_ms = 0
+                else:
+                    silent_ms += FRAME_MS
+
+                if not heard_speech:
+                    continue  # don't buffer leading silence
+
+                buffer += frame
+                max_bytes = MAX_BUFFER_SECONDS * SAMPLE_RATE * 2
+                if len(buffer) > max_bytes:
+                    buffer = buffer[-max_bytes:]
+
+                # Endpoint: user went quiet, finalize with one last decode
+                if silent_ms >= ENDPOINT_SILENCE_MS:
+                    t_vad_endpoint = time.monotonic()
+                    final = await loop.run_in_executor(
+                        None, self._transcribe, buffer
+                    )
+                    self.last_eou_ms = round(
+                        (time.monotonic() - t_vad_endpoint) * 1000
+                    )
+                    return final
+
+                # Incremental decode for partial hypotheses; only when we
+                # have caught up with the queue, so decodes never run on a
+                # buffer that is already stale
+                now = time.monotonic()
+                if now - last_decode >= DECODE_INTERVAL and frames.empty():
+                    last_decode = now
+                    text = await loop.run_in_executor(
+                        None, self._transcribe, buffer
+                    )
+                    words = text.split()
+                    agreed = self._agreed_prefix(prev_words, words)
+                    prev_words = words
+                    if agreed and agreed != stable:
+                        stable = agreed
+                        if on_partial:
+                            on_partial(stable)
+        finally:
+            reader_task.cancel()
+
+    def _read_frame(self):
+        return self.stream.read(FRAME_SAMPLES, exception_on_overflow=False)
+
+    def _is_speech(self, frame):
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768.0
+        prob = self.vad_model(torch.from_numpy(samples), SAMPLE_RATE).item()
+        return prob >= SPEECH_PROB_THRESHOLD
+
+    def _transcribe(self, pcm):
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.model.transcribe(
+            audio,
+            language="en",
+            beam_size=1,
+            vad_filter=True,
+            condition_on_previous_text=False
+        )
+        return " ".join(seg.text.strip() for seg in segments).strip()
+
+    @staticmethod
+    def _agreed_prefix(prev_words, words):
+        agreed = 0
+        for a, b in zip(prev_words, words):
+            if a.lower() != b.lower():
+                break
+            agreed += 1
+        return " ".join(words[:agreed])